@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+# Async evaluation: many zrlang tasks on one asyncio event loop.
+#
+#   python aio.py FILE
+#
+# run() drives the continuation machine of c.py, which yields whenever a
+# builtin hands back a coroutine; it awaits the coroutine and resumes the
+# machine with the result. Only the builtins below do that, and they are
+# only in the environment here:
+#
+#   {ms sleep ()}          waits ms milliseconds, then returns ms
+#   {path read ()}         the contents of file path
+#   {cmd sh ()}            the stdout of shell command cmd, {cmd sh input}
+#                          feeds it input on stdin
+#   {x spawn f}            starts `{x f ()}` as a task and returns it at
+#                          once, {x spawn f:y} for `{x f y}`
+#   {t await ()}           the result of task t, of each task in an array
+#                          of them, in order
+#
+# A task runs whenever the one before it waits on something, so tasks only
+# interleave at these builtins. Functions called by synchronous builtins,
+# such as `each` or `fold`, run on the closure compiler and can't wait,
+# reaching one of these there is an error; tasks still running when the
+# program ends are cancelled.
+
+import asyncio
+import sys
+
+from cache import parse_file
+from c import (
+    NIL, OPS, OUT, Array, Async, Builtin, Cons, Frame, Function, String, Value,
+    callable_, machine, mkvec, toint,
+)
+
+
+class Task(Value):
+    __slots__ = ()
+    def __repr__(self):
+        return f"task()"
+
+
+async def run(x, env):
+    g = machine(x, env)
+    try:
+        aw = g.send(None)
+        while True:
+            try:
+                y = await aw
+            except Exception as e:
+                aw = g.throw(e)
+            else:
+                aw = g.send(y)
+    except StopIteration as e:
+        return e.value
+
+async def call(f, a, b):
+    if isinstance(f, Function):
+        return await run(f.body, Frame(f, a, b, f.env))
+    name = f.v if type(f) is String else f
+    if type(name) is str and name in AOPS:
+        f = AOPS[name]
+    if isinstance(f, Async):
+        return await f.fn(a, b)
+    return callable_(f)(a, b)
+
+
+def sleep(a, b):
+    return asyncio.sleep(toint(a) / 1000, a)
+
+def read_file(name):
+    with open(name) as f:
+        return f.read()
+
+def read(a, b):
+    return asyncio.to_thread(read_file, a.v if isinstance(a, String) else a)
+
+async def sh_(cmd, stdin):
+    p = await asyncio.create_subprocess_shell(
+        cmd, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE)
+    out, _ = await p.communicate(stdin)
+    return out.decode()
+
+def sh(a, b):
+    cmd = a.v if isinstance(a, String) else a
+    if b is NIL:
+        return sh_(cmd, None)
+    return sh_(cmd, (b.v if isinstance(b, String) else str(b)).encode())
+
+def spawn(a, b):
+    f, y = b.v if isinstance(b, Cons) else (b, NIL)
+    return Task(asyncio.ensure_future(call(f, a, y)))
+
+async def wait(a):
+    if isinstance(a, Array):
+        return mkvec(list(await asyncio.gather(*(t.v for t in a.v))))
+    return await a.v
+
+def await_(a, b):
+    if isinstance(a, Task) or isinstance(a, Array) and all(isinstance(t, Task) for t in a.v):
+        return wait(a)
+    raise ValueError(f"not a task: {type(a).__name__}")
+
+AOPS = {
+    "sleep": Async(sleep),
+    "read": Async(read),
+    "sh": Async(sh),
+    "spawn": Builtin(spawn),
+    "await": Async(await_),
+}
+
+
+if __name__ == "__main__":
+    y = parse_file(sys.argv[1])
+    z = asyncio.run(run(y, Frame(None, None, None, None, {**OPS, **AOPS})))
+    OUT.flush()
+    print(z)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+# Batch runner: evaluates many .tvl scripts on a pool of worker processes
+# and streams one JSON line per script, in the order given.
+#
+#   python batch.py [-j WORKERS] [-e ENGINE] PATH...
+#
+# A PATH may be a file, a directory (its *.tvl files, recursively) or a
+# glob. Each worker imports the interpreter and builds the OPS frame once;
+# every script then runs in a fresh child frame of it, so assignments stay
+# private to the script. Parses go through the on-disk cache. `pr` output
+# is captured per script. The exit status is 1 if any script failed.
+
+import glob
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import c
+import vm
+from cache import parse_cached
+from c import OPS, OUT, Frame
+
+ENGINES = {
+    "execute": lambda y, env: c.execute(c.compile_(y), env),
+    "exe": c.exe,
+    "stack": c.exe_stack,
+    "vm": lambda y, env: vm.run(vm.compile_(y), env),
+}
+
+ROOT = None
+ENGINE = None
+
+
+def warm(engine):
+    # worker initializer
+    global ROOT, ENGINE
+    ROOT = Frame(None, None, None, None, {**OPS})
+    ENGINE = ENGINES[engine]
+    ENGINE(c.parse("{'f\n= {'x\n-> {x} + 1}} ; (1 f ())\0\0"), Frame(None, None, None, ROOT))
+
+def run_file(path):
+    r = {"file": path}
+    out = OUT.sink = io.StringIO()
+    t = time.perf_counter()
+    try:
+        with open(path) as f:
+            y = parse_cached(f.read() + "\0\0")
+        t1 = time.perf_counter()
+        r["parse_ms"] = (t1 - t) * 1000
+        z = ENGINE(y, Frame(None, None, None, ROOT))
+        r["eval_ms"] = (time.perf_counter() - t1) * 1000
+        r["ok"] = True
+        r["value"] = str(z)
+    except Exception as e:
+        r["ok"] = False
+        r["error"] = f"{type(e).__name__}: {e}"
+    OUT.flush()
+    r["output"] = out.getvalue()
+    return r
+
+def expand(paths):
+    for p in paths:
+        if os.path.isdir(p):
+            yield from sorted(glob.glob(os.path.join(p, "**", "*.tvl"), recursive=True))
+        elif glob.has_magic(p):
+            yield from sorted(glob.glob(p, recursive=True))
+        else:
+            yield p
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    workers, engine = os.cpu_count(), "execute"
+    while args and args[0] in ("-j", "-e"):
+        flag, value = args[0], args[1]
+        args = args[2:]
+        if flag == "-j":
+            workers = int(value)
+        else:
+            engine = value
+
+    files = list(expand(args))
+    if workers <= 1:
+        warm(engine)
+        results = map(run_file, files)
+    else:
+        ex = ProcessPoolExecutor(workers, initializer=warm, initargs=(engine,))
+        chunksize = max(1, min(64, len(files) // (workers * 4)))
+        results = ex.map(run_file, files, chunksize=chunksize)
+
+    failed = False
+    for r in results:
+        failed = failed or not r["ok"]
+        sys.stdout.write(json.dumps(r) + "\n")
+        sys.stdout.flush()
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+# Parse and eval benchmarks across the three interpreter generations:
+# a.py (stack calculator, arithmetic only), b.py (string tokens) and c.py
+# (Token/Number parser) with all of its engines. b.py programs use its own
+# dialect, where `(...)` holds raw names; examples/*.tvl are written in it.
+#
+#   python bench/bench.py [-n REPEAT] [-o OUT.json] [-b BASELINE.json]
+#                         [-t TOLERANCE] [CASE...]
+#
+# Times are the best of REPEAT runs; peak is the tracemalloc peak of a
+# separate run. Results go to OUT.json; with a baseline, cases slower than
+# it by more than TOLERANCE (a fraction) are reported and the exit status
+# is 1. bench/baseline.json is the stored baseline.
+
+import contextlib
+import glob
+import io
+import json
+import os
+import platform
+import runpy
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.setrecursionlimit(100000)
+
+import b
+import c
+import vm
+
+C_PROGRAMS = {
+    "fib": """
+{'fib
+= {'n
+-> {n} == 0 ? 0 | {n} == 1 ? 1 | ({n} - 1 _f ()) + ({n} - 2 _f ())}};
+{18 fib ()}
+""",
+    "loop": """
+{'loop
+= {'n
+:'acc
+-> {n} == 0 ? {acc} | ({n} - 1) _f ({acc} + {n})}};
+{50000 loop 0}
+""",
+    "fac": """
+{'fac
+= {'n
+-> {n} == 0 ? 1 | ({n} - 1 _f()) * {n}}};
+{300 fac ()}
+""",
+}
+
+B_PROGRAMS = {
+    "fib": """
+fib = (n -> {n} == 0 ? 0 | {n} == 1 ? 1 | ({n} - 1 _f ()) + ({n} - 2 _f ()));
+18 fib ()
+""",
+    "loop": """
+loop = (n:acc -> {n} == 0 ? {acc} | ({n} - 1) _f ({acc} + {n}));
+50000 loop 0
+""",
+    "fac": """
+fac = (n -> {n} == 0 ? 1 | ({n} - 1 _f()) * {n});
+300 fac ()
+""",
+}
+
+def arith(n):
+    # valid in all three dialects
+    return " + ".join(f"({i} + {i + 1}) * {i % 7} - {i % 3}" for i in range(n))
+
+def c_source(n):
+    return " ; ".join(f"{{'v{i}\n= {i} + {i} * 2}}" for i in range(n))
+
+def b_source(n):
+    return " ; ".join(f"(v{i} = {i} + {i} * 2)" for i in range(n))
+
+def c_tokens(n):
+    xs = [c.Number("1")]
+    for i in range(n):
+        xs += [c.Token("+*"[i % 2]), c.Number(str(i))]
+    return xs
+
+def b_tokens(n):
+    xs = ["1"]
+    for i in range(n):
+        xs += ["+*"[i % 2], str(i)]
+    return xs
+
+
+# `pr` goes nowhere, b.py's sleeps included
+
+c.OUT.sink = open(os.devnull, "w")
+
+def b_env():
+    return ({**b.OPS, "pr": b.Builtin(lambda x, y: x)}, None)
+
+def c_env():
+    return c.Frame(None, None, None, None, {**c.OPS})
+
+def b_parse(src):
+    return b.parse([-1], "\0", False, [], src + "\0\0")
+
+def c_parse(src):
+    return c.parse(src + "\0\0")
+
+def fresh():
+    c.CODE.clear()
+    vm.CODES.clear()
+
+C_ENGINES = {
+    "c.exe": lambda y: c.exe(y, c_env()),
+    "c.execute": lambda y: c.execute(c.compile_(y), c_env()),
+    "c.exe_stack": lambda y: c.exe_stack(y, c_env()),
+    "vm": lambda y: vm.run(vm.compile_(y), c_env()),
+}
+
+def run_a(src):
+    argv = sys.argv
+    sys.argv = ["a.py", src]
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            runpy.run_path(os.path.join(ROOT, "a.py"), run_name="__main__")
+    finally:
+        sys.argv = argv
+
+
+def cases():
+    # name -> (setup, run): setup() builds the input outside the timing
+    cs = {}
+    csrc, bsrc, asrc = c_source(20000), b_source(20000), arith(300)
+    cs["parse/c"] = (lambda: csrc, c_parse)
+    cs["parse/b"] = (lambda: bsrc, b_parse)
+    cs["shunt/c"] = (lambda: c_tokens(100000), c.shunt)
+    cs["shunt/b"] = (lambda: b_tokens(100000), b.shunt)
+
+    cs["eval/arith/a"] = (lambda: asrc, run_a)
+    cs["eval/arith/b"] = (lambda: b_parse(asrc), lambda y: b.exe(y, b_env()))
+    for engine, f in C_ENGINES.items():
+        cs[f"eval/arith/{engine}"] = (lambda: c_parse(asrc), f)
+
+    for name, src in B_PROGRAMS.items():
+        cs[f"eval/{name}/b"] = (lambda src=src: b_parse(src), lambda y: b.exe(y, b_env()))
+    for name, src in C_PROGRAMS.items():
+        for engine, f in C_ENGINES.items():
+            cs[f"eval/{name}/{engine}"] = (lambda src=src: c_parse(src), f)
+
+    for path in sorted(glob.glob(os.path.join(ROOT, "examples", "*.tvl"))):
+        name = os.path.splitext(os.path.basename(path))[0]
+        with open(path) as f:
+            src = f.read()
+        cs[f"eval/{name}.tvl/b"] = (lambda src=src: b_parse(src), lambda y: b.exe(y, b_env()))
+    return cs
+
+def measure(setup, run, repeat):
+    best = None
+    for _ in range(repeat):
+        x = setup()
+        fresh()
+        t = time.perf_counter()
+        run(x)
+        t = time.perf_counter() - t
+        best = t if best is None else min(best, t)
+
+    x = setup()
+    fresh()
+    tracemalloc.start()
+    try:
+        run(x)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"time": best, "peak": peak}
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, r in results.items():
+        old = baseline.get(name)
+        if old is None or "time" not in old or "time" not in r:
+            continue
+        ratio = r["time"] / old["time"]
+        r["ratio"] = ratio
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+    return regressions
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    repeat, out, base, tolerance = 3, None, None, .25
+    while args and args[0] in ("-n", "-o", "-b", "-t"):
+        flag, value = args[0], args[1]
+        args = args[2:]
+        if flag == "-n":
+            repeat = int(value)
+        elif flag == "-o":
+            out = value
+        elif flag == "-b":
+            base = value
+        else:
+            tolerance = float(value)
+
+    results = {}
+    for name, (setup, run) in cases().items():
+        if args and not any(name.startswith(a) for a in args):
+            continue
+        try:
+            results[name] = measure(setup, run, repeat)
+        except Exception as e:
+            results[name] = {"error": f"{type(e).__name__}: {e}"}
+
+    regressions = []
+    if base is not None:
+        with open(base) as f:
+            regressions = compare(results, json.load(f)["results"], tolerance)
+
+    for name, r in results.items():
+        if "error" in r:
+            print(f"{name:28} {r['error']}")
+            continue
+        ratio = f"{r['ratio']:6.2f}x" if "ratio" in r else ""
+        flag = "  REGRESSION" if name in regressions else ""
+        print(f"{name:28} {r['time'] * 1000:10.2f} ms {r['peak'] / 1024:10.0f} KiB "
+              f"{ratio}{flag}")
+
+    if out is not None:
+        with open(out, "w") as f:
+            json.dump({"python": platform.python_version(), "results": results},
+                      f, indent=1, sort_keys=True)
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+
+# Peak RSS of parsing and running a generated program of N assignment
+# statements plus an N element array literal.
+#
+#   python bench/mem.py [N]
+
+import os
+import resource
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from c import OPS, Frame, exe_stack, parse
+
+
+def program(n):
+    xs = [f"{{'v{i}\n= {i} + {i} * 2}}" for i in range(n)]
+    xs.append("{'data\n= [" + " ".join(map(str, range(n))) + "]}")
+    return " ; ".join(xs) + "\0\0"
+
+def maxrss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    x = program(n)
+    start = maxrss()
+    y = parse(x)
+    parsed = maxrss()
+    exe_stack(y, Frame(None, None, None, None, {**OPS}))
+    ran = maxrss()
+    print(f"statements {n}: start {start} MiB, parse +{parsed - start} MiB, "
+          f"run +{ran - parsed} MiB, peak {ran} MiB")
@@ -1,60 +1,207 @@
 #!/usr/bin/env python3
 
+import atexit
+import io
+import math
+import operator
+import os
+import re
 import sys
+import time
+from array import array
+from collections import OrderedDict
+from collections.abc import Iterator
+from functools import reduce
+from itertools import islice, repeat
+from types import CoroutineType
+from operator import attrgetter
 from dataclasses import dataclass
 
 NIL = None
 
+# bumped on every assignment to a name, so lookups cached by the closure
+# compiler can tell when they may have been shadowed or rebound
+VERSIONS = {}
+
 class Value:
+    __slots__ = ("v",)
     def __init__(self, v): self.v = v
 class String(Value):
+    __slots__ = ()
     def __repr__(self):
         return f'"{self.v}"'
-class RawString(String): pass
+class RawString(String):
+    __slots__ = ()
 class Comment(Value):
+    __slots__ = ()
     def __repr__(self):
         return f'#{self.v}'
 class Block(Value):
+    __slots__ = ()
     def __repr__(self):
         return f"\\[{self.v}]"
 class Builtin(Value):
+    __slots__ = ("fn",)
     def __init__(self, fn):
         self.fn = fn
+    def __reduce__(self):
+        # builtins travel by their name in OPS
+        for name, op in OPS.items():
+            if op is self:
+                return opsget, (name,)
+        raise TypeError("can't pickle a builtin that isn't in OPS")
     def __repr__(self):
         return f"builtin()"
 class Special(Builtin):
+    __slots__ = ()
     def __repr__(self):
         return f"special()"
+class Async(Builtin):
+    # returns a coroutine, which only aio.run() can wait for
+    __slots__ = ()
 class Function(Value):
+    __slots__ = ("xname", "yname", "env", "body", "code", "bytecode", "name")
     def __init__(self, xname, yname, body, env):
         self.xname = xname
         self.yname = yname
         self.env = env
         self.body = body
+        self.code = None
+        self.bytecode = None
+        self.name = None # the name it was first assigned to
+    def __reduce__(self):
+        # pickled as its body and the current values of its free names, so
+        # it can run in another process; the state goes separately so that
+        # a function referring to itself by name pickles as a cycle
+        free = {}
+        for key in freevars(self.body, set()) - {self.xname, self.yname, "_f"}:
+            v = envget(self.env, key)
+            if v is not NIL and OPS.get(key) is not v:
+                free[key] = v
+        return Function, (self.xname, self.yname, self.body, None), (self.name, free)
+    def __setstate__(self, state):
+        self.name, free = state
+        self.env = Frame(None, None, None, None, {**OPS, **free})
+        self.code = self.bytecode = None
     def __repr__(self):
         return f"func()"
+class Memo(Builtin):
+    # a Function behind an LRU cache of its results, keyed on the values
+    # of both arguments; calls with unhashable arguments go straight through
+    __slots__ = ("func", "size", "cache", "hits", "misses")
+    def __init__(self, func, size):
+        self.fn = self.call
+        self.func = func
+        self.size = size
+        self.cache = OrderedDict()
+        self.hits = self.misses = 0
+    def __reduce__(self):
+        return Memo, (self.func, self.size)
+    def call(self, a, b):
+        try:
+            key = memokey(a), memokey(b)
+        except TypeError:
+            return self.run(a, b)
+        cache = self.cache
+        if key in cache:
+            self.hits += 1
+            cache.move_to_end(key)
+            return cache[key]
+        self.misses += 1
+        y = cache[key] = self.run(a, b)
+        if len(cache) > self.size:
+            cache.popitem(last=False)
+        return y
+    def run(self, a, b):
+        env = Frame(self.func, a, b, self.func.env)
+        env.f = self # `_f` recursion goes through the cache too
+        return execute(body(self.func), env)
+    def __repr__(self):
+        return f"memo()"
+class Frame:
+    # Function frames hold `_f` and both parameters in fixed slots; names
+    # bound by `=` go to `vars`, which is only created on first assignment.
+    __slots__ = ("fn", "f", "x", "y", "vars", "up", "captured")
+    def __init__(self, fn, x, y, up, vars=None):
+        self.fn = self.f = fn
+        self.x = x
+        self.y = y
+        self.up = up
+        self.vars = vars
+        self.captured = False
+    def set(self, key, v):
+        fn = self.fn
+        if fn is not None:
+            if key == fn.yname:
+                self.y = v
+                return
+            if key == fn.xname:
+                self.x = v
+                return
+            if key == "_f":
+                self.f = v
+                return
+        if self.vars is None:
+            self.vars = {}
+        self.vars[key] = v
+        VERSIONS[key] = VERSIONS.get(key, 0) + 1
 class Quote(Value):
+    # `holes` maps out the Unquotes of the template when it's built, see
+    # holes(); a template without any always evaluates to the same Block
+    __slots__ = ("holes", "block")
+    def __init__(self, v):
+        self.v = v
+        self.holes = holes(v)
+        self.block = Block(v) if not self.holes else None
     def __repr__(self):
         return f"\\[{self.v}]"
 class Unquote(Value):
+    __slots__ = ()
     def __repr__(self):
         return f"/[{self.v}]"
 class Var(Value):
+    __slots__ = ()
     def __repr__(self):
         return f"{{{self.v}}}"
 class Token(Value):
+    __slots__ = ()
     def __repr__(self):
         return f"{self.v}"
 class Number(Value):
+    __slots__ = ()
     def __repr__(self):
         return f"{self.v}"
 class Array(Value):
+    __slots__ = ()
     def __repr__(self):
         return "[" + " ".join(map(str, self.v)) + "]"
-class ParsedArray(Array): pass
+class IntArray(Array):
+    # an Array of machine ints kept unboxed in an array("q")
+    __slots__ = ()
+class ParsedArray(Array):
+    __slots__ = ()
 class Cons(Value):
+    __slots__ = ()
     def __repr__(self):
         return f"({self.v[0]}, {self.v[1]})"
+class Seq(Value):
+    # a lazy sequence; `v` makes a fresh iterator each time, so a Seq can
+    # be consumed more than once
+    __slots__ = ()
+    def __iter__(self):
+        return self.v()
+    def __repr__(self):
+        return "[" + " ".join(map(str, self)) + "]"
+class Dict(Value):
+    # a pair array: keys in `v` and values in `vals`, two column Arrays,
+    # with `index` mapping each key to its row
+    __slots__ = ("vals", "index")
+    def __init__(self):
+        self.v = IntArray(array("q"))
+        self.vals = IntArray(array("q"))
+        self.index = {}
+    def __repr__(self):
+        return "(" + ", ".join(f"{k}:{v}" for k, v in zip(self.v.v, self.vals.v)) + ")"
 
 def else_(a, b, _):
     if a == NIL:
@@ -66,13 +213,108 @@ def mkfunc(a, b, env):
         xname, yname = a.v
     else:
         xname, yname = a, None
+    env.captured = True
     return Function(str(xname), str(yname), b, env)
 
+def mkvec(xs):
+    # an IntArray if every element is an int that fits, else an Array
+    if all(type(x) is int for x in xs):
+        try:
+            return IntArray(array("q", xs))
+        except OverflowError:
+            pass
+    return Array(list(xs))
+
+def unbox(a):
+    # degrade an IntArray in place, other references see the same Array
+    a.__class__ = Array
+    a.v = a.v.tolist()
+
 def mkarray(a, b):
     if isinstance(a, Array):
+        if type(a) is IntArray:
+            if type(b) is int:
+                try:
+                    a.v.append(b)
+                    return a
+                except OverflowError:
+                    pass
+            unbox(a)
         a.v.append(b)
         return a
-    return Array([a, b])
+    elif isinstance(a, Dict):
+        if isinstance(b, Cons) and dictset(a, *b.v):
+            return a
+        return mkarray(mkvec([Cons(kv) for kv in zip(a.v.v, a.vals.v)]), b)
+    return mkvec([a, b])
+
+def mkdict(a, b):
+    # `pairs dict ()`: a Dict from k:v Conses, later rows winning
+    d = Dict()
+    for x in items(a):
+        if not isinstance(x, Cons):
+            raise ValueError(f"dict: {type(x).__name__} is not a pair")
+        if not dictset(d, *x.v):
+            raise ValueError(f"dict: can't hash key {x.v[0]}")
+    return d
+
+def dictkey(x):
+    # Strings and raw strings with the same text are the same key
+    if type(x) is String:
+        return x.v
+    return memokey(x)
+
+def dictset(d, k, v):
+    try:
+        key = dictkey(k)
+    except TypeError:
+        return False
+    i = d.index.get(key)
+    if i is None:
+        d.index[key] = len(d.v.v)
+        mkarray(d.v, k)
+        mkarray(d.vals, v)
+        return True
+    vals = d.vals
+    if type(vals) is IntArray and type(v) is int:
+        try:
+            vals.v[i] = v
+            return True
+        except OverflowError:
+            pass
+    if type(vals) is IntArray:
+        unbox(vals)
+    vals.v[i] = v
+    return True
+
+def lookup(a, b):
+    if isinstance(a, Dict):
+        try:
+            i = a.index.get(dictkey(b))
+        except TypeError:
+            return NIL
+        return NIL if i is None else a.vals.v[i]
+    elif isinstance(a, Array):
+        try:
+            return a.v[toint(b)]
+        except IndexError:
+            return NIL
+    elif isinstance(a, Seq):
+        return next(islice(a, toint(b), None), NIL)
+    raise ValueError(f"@: can't index {type(a).__name__}")
+
+def index(a, b):
+    # `a @ k`: the value under key k of a Dict or at position k of an Array;
+    # an Array of keys gathers an Array of values
+    if isinstance(b, Array):
+        return mkvec([lookup(a, k) for k in b.v])
+    return lookup(a, b)
+
+def columns(a, b):
+    # copies, since `,` appends to Arrays in place
+    if not isinstance(a, Dict):
+        raise ValueError(f"{type(a).__name__} is not a dict")
+    return type(a.v)(a.v.v[:]), type(a.vals)(a.vals.v[:])
 
 
 def assign(a, b, env):
@@ -88,20 +330,347 @@ def assign_(a, b, env):
             assign_(a.v[0], b, env)
             assign_(a.v[1], b, env)
     else:
-        env[0][a] = b
+        if isinstance(b, Function) and b.name is None:
+            b.name = str(a)
+        env.set(a, b)
     return b
 
+MEMO_SIZE = 1024
+
+def memokey(x):
+    if x is None or type(x) in (int, str):
+        return x
+    elif type(x) is bool:
+        return "bool", x
+    elif type(x) is String:
+        return "str", x.v
+    elif type(x) is Cons:
+        return "cons", memokey(x.v[0]), memokey(x.v[1])
+    raise TypeError(f"unhashable: {type(x).__name__}")
+
+def memo(a, b):
+    if isinstance(a, Memo):
+        a = a.func
+    if not isinstance(a, Function):
+        raise ValueError(f"memo: {type(a).__name__} is not a function")
+    return Memo(a, MEMO_SIZE if b is NIL else toint(b))
+
+def memostats(a, b):
+    if not isinstance(a, Memo):
+        raise ValueError(f"memostats: {type(a).__name__} is not memoized")
+    return mkvec([a.hits, a.misses, len(a.cache)])
+
+# arithmetic with a fast path for plain ints, skipping toint(); Array
+# operands are broadcast elementwise
+
+VECTORS = (Array, Seq)
+
+def iterate(a):
+    if isinstance(a, Array):
+        return iter(a.v)
+    elif isinstance(a, Seq):
+        return iter(a)
+    return repeat(a)
+
+def broadcast(fn, native, a, b):
+    # one map() over both operands, a scalar repeated to the array's length;
+    # int arrays and ints use the `native` operator, anything else goes back
+    # through `fn` per element, so nested arrays broadcast too
+    if isinstance(a, Seq) or isinstance(b, Seq):
+        # lazily, stopping at the shorter operand
+        return Seq(lambda: map(fn, iterate(a), iterate(b)))
+    f = native if type(a) in (IntArray, int) and type(b) in (IntArray, int) else fn
+    if isinstance(a, Array):
+        xs = a.v
+        if isinstance(b, Array):
+            ys = b.v
+            if len(xs) != len(ys):
+                raise ValueError(f"length mismatch: {len(xs)} <> {len(ys)}")
+        else:
+            ys = repeat(b, len(xs))
+    else:
+        ys = b.v
+        xs = repeat(a, len(ys))
+    return mkvec(list(map(f, xs, ys)))
+
+def add(a, b):
+    if type(a) is int and type(b) is int:
+        return a + b
+    if isinstance(a, VECTORS) or isinstance(b, VECTORS):
+        return broadcast(add, operator.add, a, b)
+    return toint(a) + toint(b)
+
+def mul(a, b):
+    if type(a) is int and type(b) is int:
+        return a * b
+    if isinstance(a, VECTORS) or isinstance(b, VECTORS):
+        return broadcast(mul, operator.mul, a, b)
+    return toint(a) * toint(b)
+
+def sub(a, b):
+    if type(a) is int and type(b) is int:
+        return a - b
+    if isinstance(a, VECTORS) or isinstance(b, VECTORS):
+        return broadcast(sub, operator.sub, a, b)
+    return toint(a) - toint(b)
+
+def eq_(a, b):
+    return a == b or NIL
+
+def eq(a, b):
+    if type(a) is int and type(b) is int:
+        return a == b or NIL
+    if isinstance(a, VECTORS) or isinstance(b, VECTORS):
+        # a mask of the scalar results, True or NIL per element
+        return broadcast(eq, eq_, a, b)
+    return (toint(a) == toint(b)) or NIL
+
+# iteration builtins; they loop in Python or C and only enter the
+# interpreter to call a user Function. The function argument may be a
+# Function, a Builtin or the name of one in OPS (`{xs fold +}`), optionally
+# paired with a second argument or initial value (`{xs each * : 2}`)
+
+REDUCERS = {add: (sum, 0), mul: (math.prod, 1)}
+
+def callable_(f):
+    name = f.v if type(f) is String else f
+    if type(name) is str:
+        f = OPS.get(name)
+    if isinstance(f, Function):
+        fn = f
+        return lambda a, b: execute(body(fn), Frame(fn, a, b, fn.env))
+    elif isinstance(f, Async):
+        raise ValueError("awaitable builtin outside async mode")
+    elif isinstance(f, Builtin) and not isinstance(f, Special):
+        return f.fn
+    raise ValueError(f"not a function: {type(f).__name__}")
+
+def fnarg(b, default):
+    if isinstance(b, Cons):
+        f, y = b.v
+        return callable_(f), y
+    return callable_(b), default
+
+def items(a):
+    if a is NIL:
+        # `[]` evaluates to NIL
+        return ()
+    elif isinstance(a, Array):
+        return a.v
+    elif isinstance(a, Seq):
+        return iter(a)
+    elif isinstance(a, Dict):
+        return [Cons(kv) for kv in zip(a.v.v, a.vals.v)]
+    raise ValueError(f"can't iterate {type(a).__name__}")
+
+def range_(a, b):
+    if b is NIL:
+        a, b = 0, a
+    r = range(toint(a), toint(b))
+    return Seq(lambda: iter(r))
+
+def lines(a, b):
+    # the lines of file `a`, reopened on every pass
+    name = a.v if isinstance(a, String) else a
+    def gen():
+        with open(name) as f:
+            for line in f:
+                yield line.rstrip("\n")
+    return Seq(gen)
+
+def chunks(xs, n=4096):
+    # Seqs are folded a chunk at a time to keep the fast reducers
+    if not isinstance(xs, Iterator):
+        yield xs
+        return
+    while chunk := list(islice(xs, n)):
+        yield chunk
+
+def fold_(g, xs, init):
+    reducer = REDUCERS.get(g)
+    if reducer is not None and init is NIL:
+        init = reducer[1]
+    for chunk in chunks(xs):
+        if init is NIL:
+            if not len(chunk):
+                continue
+            init, chunk = chunk[0], chunk[1:]
+        # only ints take the fast reducers: math.prod repeats a string
+        # instead of failing on it, unlike `*`
+        if (reducer is not None and type(init) is int
+                and (type(chunk) is array or all(type(x) is int for x in chunk))):
+            init = reducer[0](chunk, start=init)
+        else:
+            init = reduce(g, chunk, init)
+    return init
+
+def fold(a, b):
+    g, init = fnarg(b, NIL)
+    return fold_(g, items(a), init)
+
+def sum_(a, b):
+    return fold_(add, items(a), 0)
+
+def prod(a, b):
+    return fold_(mul, items(a), 1)
+
+def each(a, b):
+    g, y = fnarg(b, NIL)
+    if (g in (add, mul, sub, eq) and isinstance(a, (Array, Seq))
+            and not isinstance(y, (Array, Seq))):
+        # already a single broadcast
+        return g(a, y)
+    if isinstance(a, Seq):
+        return Seq(lambda: (g(x, y) for x in a))
+    return mkvec([g(x, y) for x in items(a)])
+
+def filter_(a, b):
+    g, y = fnarg(b, NIL)
+    if isinstance(a, Seq):
+        return Seq(lambda: (x for x in a if g(x, y) != NIL))
+    return mkvec([x for x in items(a) if g(x, y) != NIL])
+
+def take(a, b):
+    n = toint(b)
+    if isinstance(a, Seq):
+        return Seq(lambda: islice(a, n))
+    return mkvec(list(islice(items(a), n)))
+
+def toarray(a, b):
+    if isinstance(a, Array):
+        return a
+    return mkvec(list(items(a)))
+
+# `xs pmap f` is `each` on a process pool: elements go out in chunks,
+# functions are pickled as their body and free names (Function.__reduce__)
+# and results come back in order, together with whatever `pr` wrote in the
+# worker. PMAP_WORKERS defaults to the CPU count. The pool is shut down at
+# exit, in multiprocessing children (batch.py workers) as well.
+
+PMAP_WORKERS = None
+PMAP_CHUNKS = 4 # per worker
+POOL = None
+
+def opsget(name):
+    return OPS[name]
+
+def freevars(x, acc):
+    # every name the AST could look up, a superset of its free names
+    if isinstance(x, tuple):
+        for x_ in x:
+            freevars(x_, acc)
+    elif isinstance(x, (Var, Token)):
+        acc.add(x.v)
+    elif isinstance(x, Unquote):
+        freevars(x.v, acc)
+    elif isinstance(x, Quote):
+        for x_ in x.v:
+            quotevars(x_, acc)
+    elif isinstance(x, ParsedArray):
+        for x_ in x.v:
+            freevars(x_, acc)
+    return acc
+
+def quotevars(x, acc):
+    if isinstance(x, Unquote):
+        freevars(x.v, acc)
+    elif isinstance(x, (tuple, list)):
+        for x_ in x:
+            quotevars(x_, acc)
+
+def pool():
+    global POOL
+    if POOL is None:
+        from concurrent.futures import ProcessPoolExecutor
+        from multiprocessing.util import Finalize
+        POOL = ProcessPoolExecutor(PMAP_WORKERS)
+        # before the finalizers of its queues, which would otherwise stop
+        # the feeder thread ahead of the workers' shutdown sentinels
+        Finalize(POOL, POOL.shutdown, exitpriority=100)
+    return POOL
+
+def pmap_chunk(f, y, xs):
+    g = callable_(f)
+    sink = OUT.sink
+    out = OUT.sink = io.StringIO()
+    try:
+        ys = [g(x, y) for x in xs]
+        OUT.flush()
+        return ys, out.getvalue()
+    finally:
+        OUT.buf.clear()
+        OUT.n = 0
+        OUT.sink = sink
+
+def pmap(a, b):
+    f, y = b.v if isinstance(b, Cons) else (b, NIL)
+    callable_(f) # fail early, not in a worker
+    xs = list(items(a))
+    if not xs:
+        return mkvec([])
+    n = max(1, len(xs) // ((PMAP_WORKERS or os.cpu_count()) * PMAP_CHUNKS))
+    chunks = [xs[i:i + n] for i in range(0, len(xs), n)]
+    ys = []
+    for chunk, out in pool().map(pmap_chunk, repeat(f), repeat(y), chunks):
+        ys += chunk
+        if out:
+            OUT.put(out)
+    return mkvec(ys)
+
+class Output:
+    # buffered writer behind `pr`. `sink` is anything with write() and
+    # flush(), stdout (looked up at flush time) when None. Arrays and Seqs
+    # are formatted a chunk of elements at a time, so printing a long Seq
+    # never materialises it. `throttle` flushes and sleeps after every
+    # write, for watching demos step by step.
+    def __init__(self, sink=None, size=1 << 16, throttle=0):
+        self.sink = sink
+        self.size = size
+        self.throttle = throttle
+        self.buf = []
+        self.n = 0
+
+    def put(self, s):
+        self.buf.append(s)
+        self.n += len(s)
+        if self.n >= self.size:
+            self.flush()
+
+    def write(self, x):
+        if isinstance(x, VECTORS):
+            self.put("[")
+            it = iterate(x)
+            sep = ""
+            while chunk := list(islice(it, 4096)):
+                self.put(sep + " ".join(map(str, chunk)))
+                sep = " "
+            self.put("]\n")
+        else:
+            self.put(f"{x}\n")
+        if self.throttle:
+            self.flush()
+            time.sleep(self.throttle)
+
+    def flush(self):
+        sink = self.sink or sys.stdout
+        if self.buf:
+            sink.write("".join(self.buf))
+            self.buf.clear()
+            self.n = 0
+        sink.flush()
+
+OUT = Output()
+atexit.register(OUT.flush)
+
 def pr_(a, b):
-    print(a)
-    import time
-    time.sleep(.2)
+    OUT.write(a)
     return a
 
 OPS = {
     "~":  Builtin(lambda a, b: a + b),
-    "+":  Builtin(lambda a, b: toint(a) + toint(b)),
-    "*":  Builtin(lambda a, b: toint(a) * toint(b)),
-    "-":  Builtin(lambda a, b: toint(a) - toint(b)),
+    "+":  Builtin(add),
+    "*":  Builtin(mul),
+    "-":  Builtin(sub),
     ":":  Builtin(lambda a, b: Cons((a, b))),
     "pr": Builtin(pr_),
     ",":  Builtin(mkarray),
@@ -109,13 +678,31 @@ OPS = {
     ";":  Special(lambda a, b, env: b),
     "|":  Special(else_),
     "=":  Special(assign),
-    "==": Builtin(lambda a, b: (toint(a) == toint(b)) or NIL),
+    "==": Builtin(eq),
     "?":  Builtin(lambda a, b: NIL if a == NIL else b),
     "->": Special(mkfunc),
+    "memo": Builtin(memo),
+    "memostats": Builtin(memostats),
+    "@":  Builtin(index),
+    "range": Builtin(range_),
+    "sum": Builtin(sum_),
+    "prod": Builtin(prod),
+    "fold": Builtin(fold),
+    "each": Builtin(each),
+    "map": Builtin(each),
+    "filter": Builtin(filter_),
+    "take": Builtin(take),
+    "lines": Builtin(lines),
+    "array": Builtin(toarray),
+    "pmap": Builtin(pmap),
+    "dict": Builtin(mkdict),
+    "keys": Builtin(lambda a, b: columns(a, b)[0]),
+    "vals": Builtin(lambda a, b: columns(a, b)[1]),
 }
 
 ASSOC = {
     # (associativity_precedence, right_associativity)
+    "@":  (7, 0),
     "*":  (6, 0),
     "+":  (5, 0),
     ":":  (4, 1),
@@ -133,7 +720,7 @@ def flush_til(res, ops, assoc):
             break
         H = ops.pop()[0]
         L = res.pop()
-        R = [L, H, R]
+        R = (L, H, R)
     return R
 
 def shunt(xs):
@@ -171,54 +758,50 @@ def merge_strings(buf):
     return buf_
 
 
-def parse_rawstring(i, cs, xs):
-    assert len(cs) == 0
-    while True:
-        i[0] += 1
-        c = xs[i[0]]
-        if c == "\n":
-            return "".join(cs)
-        elif c == "\0":
-            i[0] -= 1
-            return "".join(cs)
-        cs.append(c)
-
-def parse_string(i, cs, xs):
-    assert len(cs) == 0
-    escape = False
-    #while i[0] + 1 < len(xs):
-    while True:
-        i[0] += 1
-        c = xs[i[0]]
-
-        #if c == "\0": return "UNTERMINATED STRING"
-
-        if escape:
-            if c == "n":
-                cs.append("\n")
-            elif c == "t":
-                cs.append("\t")
-            elif c == '"':
-                cs.append(c)
-            elif c == "\\":
-                cs.append(c)
-            else:
-                cs.append("\\")
-                cs.append(c)
-            escape = False
-            continue
+# Tokens are runs of symbol characters (alnum and `_`) or of punctuation,
+# which is anything that is neither a symbol character nor one of
+# ' ()[]{}"#\'\n\0'. Brackets come out as plain strings: "(" or "(|" when
+# opening, ")" or "|)" when closing, with "\0" closing the whole source.
 
-        if c == '"':
-            return "".join(cs)
-        elif c == "\\":
-            escape = True
-            continue
-        elif c == "\0":
-            break
+LEX = re.compile(r"""[ \n]*(?:
+    (?P<sym>\w+)
+  | (?P<open>[(\[{]\|?)
+  | (?P<close>[)\]}\0])
+  | [^\w ()\[\]{}"\#'\n\0]*(?P<qclose>\|[)\]}])
+  | (?P<punct>[^\w ()\[\]{}"\#'\n\0]+)
+  | \#(?P<comment>[^\n\0]*)\n?
+  | '(?P<raw>[^\n\0]*)\n?
+  | "(?P<str>(?:[^"\\\0]|\\[\s\S])*)(?P<strend>["\0]?)
+)""", re.X)
 
-        cs.append(c)
+ESCAPES = {"n": "\n", "t": "\t", '"': '"', "\\": "\\"}
+ESCAPE = re.compile(r"\\([\s\S])")
 
-    raise ValueError(f"unterminated string: {''.join(cs)}")
+def unescape(x):
+    if "\\" not in x:
+        return x
+    return ESCAPE.sub(lambda m: ESCAPES.get(m[1], m[0]), x)
+
+def tokenize(xs):
+    for m in LEX.finditer(xs):
+        kind = m.lastgroup
+        if kind == "sym":
+            x = m[kind]
+            yield Number(x) if x.isnumeric() else Token(x)
+        elif kind == "punct":
+            yield Token(m[kind])
+        elif kind == "strend":
+            x = unescape(m["str"])
+            if m[kind] != '"':
+                raise ValueError(f"unterminated string: {x}")
+            yield String(x)
+        elif kind == "comment":
+            yield Comment(m[kind])
+        elif kind == "raw":
+            yield RawString(m[kind])
+        elif kind is not None:
+            # brackets; a punct run running into `|)` is swallowed by it
+            yield m[kind]
 
 
 def opposite_paren(start):
@@ -258,110 +841,107 @@ def _finalize(buf, leading_punct, start_paren, end_paren, quote):
     return buf
 
 
+def ispunct(x):
+    c = x.v[0]
+    return not (c.isalnum() or c == "_")
+
 # TODO expected_end has to match
-def parse(i, start_paren, quote, cs, xs):
-    assert not cs
+def parse_(lex, start_paren, quote):
+    # brackets are matched with an explicit stack of enclosing levels
+    levels = []
     buf = []
-    token = None
     leading_punct = False
 
-    while i[0] + 1 < len(xs):
-        i[0] += 1
-        c, c1 = xs[i[0]], xs[i[0] + 1]
-
-        if c.isalnum() or c in "_":
-            new_token = "symbol"
-        elif c in ' ()[]{}"#\'\n\0':
-            new_token = None
-        else:
-            new_token = "punct" # TODO make punct character set explicit
-
-        if new_token != token and token is not None:
-            if len(buf) == 0 and token == "punct":
+    for x in lex:
+        if type(x) is not str:
+            if not buf and type(x) is Token and ispunct(x):
                 leading_punct = True
-
-            cs_ = "".join(cs)
-            if token == "symbol" and all(x.isnumeric() for x in cs_):
-                cs_ = Number(cs_)
-            else:
-                cs_ = Token(cs_)
-
-            buf.append(cs_)
-            cs.clear()
-
-        if token is None: assert not cs
-
-        if new_token is not None:
-            cs.append(c)
-
-        token = new_token
-
-        if c in " \n":
-            continue
-        elif c == "#":
-            x = parse_rawstring(i, cs, xs)
-            cs.clear()
-            buf.append(Comment(x))
-        elif c == "'":
-            x = parse_rawstring(i, cs, xs)
-            cs.clear()
-            buf.append(RawString(x))
-        elif c == '"':
-            x = parse_string(i, cs, xs)
-            cs.clear()
-            buf.append(String(x))
-        elif c in "([{":
-            if c1 == "|":
-                quote_ = True
-                i[0] += 1
-            else:
-                quote_ = False
-            x = parse(i, c, quote_, cs, xs)
-            cs.clear()
             buf.append(x)
-        elif c == "|" and c1 in ")]}":
-            i[0] += 1
-            c, c1 = xs[i[0]], xs[i[0] + 1]
+            continue
+        elif x[0] in "([{":
+            levels.append((buf, leading_punct, start_paren, quote))
+            buf, leading_punct, start_paren, quote = [], False, x[0], len(x) == 2
+            continue
+        elif x[0] == "|":
+            c = x[1]
             if opposite_paren(start_paren) != c or not quote:
                 start_paren = start_paren if start_paren != "\0" else "$"
                 raise ValueError(f"Parens don't match: {start_paren} <> |{c}")
-            return _finalize(buf, leading_punct, start_paren, c, quote)
-        elif c in ")]}\0":
+        else:
+            c = x
             if opposite_paren(start_paren) != c or quote:
                 start_paren = start_paren if start_paren != "\0" else "$"
                 start_paren = ("|" if quote else "") + start_paren
                 end_paren = c if c != "\0" else "$"
                 raise ValueError(f"Parens don't match: {start_paren} <> {end_paren}")
-            return _finalize(buf, leading_punct, start_paren, c, quote)
+
+        y = _finalize(buf, leading_punct, start_paren, c, quote)
+        if not levels:
+            return y
+        buf, leading_punct, start_paren, quote = levels.pop()
+        buf.append(y)
 
     assert False
 
+def parse(xs):
+    return parse_(tokenize(xs), "\0", False)
+
 
 def toint(x):
     if x is None:
         return 0
     return int(x)
 
-def quasiquote(x, env):
-    if isinstance(x, list):
-        return [quasiquote(x_, env) for x_ in x]
-    elif isinstance(x, Unquote):
-        return exe(x.v, env)
-    else:
-        return x
+def holes(xs):
+    # (index, holes) for every element of a template that is or contains an
+    # Unquote, with None for the Unquote itself. Nested nodes are walked
+    # with an explicit stack, as in parse_(), so deep templates parse.
+    levels = []
+    hs, i = [], 0
+    while True:
+        if i < len(xs):
+            x = xs[i]
+            i += 1
+            if isinstance(x, Unquote):
+                hs.append((i - 1, None))
+            elif isinstance(x, (tuple, list)):
+                levels.append((xs, i, hs))
+                xs, hs, i = x, [], 0
+            continue
+        h = tuple(hs)
+        if not levels:
+            return h
+        xs, i, hs = levels.pop()
+        if h:
+            hs.append((i - 1, h))
+
+def quasiquote(xs, holes, env):
+    # only the nodes on the way to a hole are copied, the rest of the
+    # template is shared with the result
+    ys = list(xs)
+    for i, h in holes:
+        ys[i] = exe(xs[i].v, env) if h is None else quasiquote(xs[i], h, env)
+    return ys if type(xs) is list else tuple(ys)
 
 def envget(env, key):
     while env is not None:
-        cur, nxt = env
-        if key in cur:
+        fn = env.fn
+        if fn is not None:
+            if key == fn.yname:
+                return env.y
+            if key == fn.xname:
+                return env.x
+            if key == "_f":
+                return env.f
+        cur = env.vars
+        if cur is not None and key in cur:
             return cur[key]
-        env = nxt
+        env = env.up
     return None
 
 def exe(x, env):
     while True:
-        if isinstance(x, list):
-            assert len(x) == 3
+        if isinstance(x, tuple):
             L = exe(x[0], env)
             H = exe(x[1], env)
             R = x[2]
@@ -387,12 +967,7 @@ def exe(x, env):
                 # TODO check op dispatch
                 x = H.fn(L, R)
             elif isinstance(H, Function):
-                env_ = {"_f": H}
-                if H.xname is not None:
-                    env_[H.xname] = L
-                if H.yname is not None:
-                    env_[H.yname] = R
-                env = (env_, H.env)
+                env = Frame(H, L, R, H.env)
                 x = H.body
             else:
                 raise ValueError(f"H type: {type(H).__name__}")
@@ -405,29 +980,392 @@ def exe(x, env):
         elif isinstance(x, Unquote):
             x = x.v
         elif isinstance(x, Quote):
-            return Block(quasiquote(x.v, env))
+            if x.block is not None:
+                return x.block
+            return Block(quasiquote(x.v, x.holes, env))
         elif isinstance(x, Block):
             return x
         elif isinstance(x, ParsedArray):
-            x = Array([exe(x_, env) for x_ in x.v])
+            x = mkvec([exe(x_, env) for x_ in x.v])
+        elif type(x) is CoroutineType:
+            sync(x)
         else:
             return x
 
 
+# exe() with pending work kept on an explicit stack of continuations
+# instead of Python frames, so nesting depth is only limited by memory.
+# Every continuation records the env to resume in; calls in tail position
+# push nothing, as in exe().
+#
+# The machine is a generator so that it can suspend on a builtin that hands
+# back a coroutine, which only the async builtins of aio.py do; it yields
+# the coroutine and resumes with its result. exe_stack() runs it to the end.
+
+K_HEAD, K_SPECIAL, K_CALL, K_ASSIGN, K_ARRAY, K_QUOTE = range(6)
+NOVAL = object()
+
+def sync(y):
+    # a coroutine turned up where nothing can wait for it
+    y.close()
+    raise ValueError("awaitable builtin outside async mode")
+
+def exe_stack(x, env):
+    g = machine(x, env)
+    try:
+        y = g.send(None)
+    except StopIteration as e:
+        return e.value
+    sync(y)
+
+def machine(x, env):
+    stack = []
+    push, pop = stack.append, stack.pop
+
+    while True:
+        if isinstance(x, tuple):
+            push((K_HEAD, x, env))
+            x = x[0]
+            continue
+        elif isinstance(x, Var):
+            v = envget(env, x.v)
+        elif isinstance(x, Token):
+            v = String(x.v)
+        elif isinstance(x, Number):
+            v = int(x.v)
+        elif isinstance(x, Unquote):
+            x = x.v
+            continue
+        elif isinstance(x, Quote):
+            if x.block is not None:
+                v = x.block
+            else:
+                push((K_QUOTE, x.v, x.holes, 0, list(x.v), Block, env))
+                v = NOVAL
+        elif isinstance(x, ParsedArray):
+            push((K_ARRAY, x.v, 0, [], env))
+            v = NOVAL
+        else:
+            v = x
+
+        while True:
+            if not stack:
+                return v
+            k = pop()
+            tag = k[0]
+
+            if tag == K_HEAD:
+                _, x, env = k
+                push((K_SPECIAL, x, v, env))
+                x = x[1]
+                break
+            elif tag == K_SPECIAL:
+                _, x, L, env = k
+                H, R = v, x[2]
+                if isinstance(H, String):
+                    Hname = H.v
+                    H = envget(env, Hname)
+                    if H == NIL:
+                        raise ValueError(f"FUNC {Hname} not found")
+                if isinstance(H, Special):
+                    if H.fn is assign:
+                        push((K_ASSIGN, L, env))
+                        x = R
+                    else:
+                        x = H.fn(L, R, env)
+                else:
+                    push((K_CALL, L, H, env))
+                    x = R
+                break
+            elif tag == K_CALL:
+                _, L, H, env = k
+                if H is NIL:
+                    x = L
+                elif isinstance(H, Builtin):
+                    x = H.fn(L, v)
+                    if type(x) is CoroutineType:
+                        x = yield x
+                elif isinstance(H, Function):
+                    env = Frame(H, L, v, H.env)
+                    x = H.body
+                else:
+                    raise ValueError(f"H type: {type(H).__name__}")
+                break
+            elif tag == K_ASSIGN:
+                _, L, env = k
+                x = assign_(L, v, env)
+                break
+            elif tag == K_ARRAY:
+                _, xs, i, acc, env = k
+                if v is not NOVAL:
+                    acc.append(v)
+                if i < len(xs):
+                    push((K_ARRAY, xs, i + 1, acc, env))
+                    x = xs[i]
+                    break
+                v = mkvec(acc)
+            elif tag == K_QUOTE:
+                # quasiquote(): fill the holes of a copy of the template
+                _, xs, hs, i, ys, wrap, env = k
+                if v is not NOVAL:
+                    ys[hs[i - 1][0]] = v
+                if i == len(hs):
+                    v = wrap(ys)
+                    continue
+                j, h = hs[i]
+                push((K_QUOTE, xs, hs, i + 1, ys, wrap, env))
+                x = xs[j]
+                if h is None:
+                    x = x.v
+                    break
+                push((K_QUOTE, x, h, 0, list(x), type(x), env))
+                v = NOVAL
+
+
+# Closure compiler: each node is compiled once into a step closure
+# `k(env) -> (k_, env_)`, where `k_ is None` means `env_` is the final value.
+# Tail positions hand back the next step instead of recursing, so execute()
+# runs function bodies in a loop just like exe() does.
+#
+# Compilation carries a static scope, a chain `((xname, yname), parent)` of
+# the parameters of the enclosing `->` bodies, ending in None where the
+# layout is unknown. Vars bound by a parameter compile to a (depth, slot)
+# access; everything else only has to check the `vars` of those frames for
+# names created by `=` before falling back to envget().
+
+NODES = (tuple, Var, Token, Number, Unquote, Quote, ParsedArray)
+CODE = {}
+
+def execute(k, env):
+    while k is not None:
+        k, env = k(env)
+    return env
+
+def code(x, tail=False):
+    k = CODE.get((id(x), tail))
+    if k is None or k[0] is not x:
+        k = CODE[id(x), tail] = (x, compile_(x, None, tail))
+    return k[1]
+
+def resume(x, env):
+    if isinstance(x, NODES):
+        return code(x), env
+    elif type(x) is CoroutineType:
+        sync(x)
+    return None, x
+
+def body(fn):
+    if fn.code is None:
+        fn.code = code(fn.body, True)
+    return fn.code
+
+def params(a):
+    # static parameter names of a `->` left side, mirroring mkfunc()
+    if isinstance(a, str):
+        return a, "None"
+    if (isinstance(a, tuple) and isinstance(a[0], str) and isinstance(a[2], str)
+            and isinstance(a[1], (Token, Var)) and a[1].v == ":"):
+        return a[0], a[2]
+    return None
+
+def resolve(name, scope):
+    depth = 0
+    while scope is not None:
+        (xname, yname), scope = scope
+        if name == yname:
+            return depth, "y"
+        if name == xname:
+            return depth, "x"
+        if name == "_f":
+            return depth, "f"
+        depth += 1
+    return depth, None
+
+def compile_get(name, scope):
+    depth, slot = resolve(name, scope)
+
+    if slot is not None and depth == 0:
+        return attrgetter(slot)
+
+    if slot is not None:
+        def get(env):
+            for _ in range(depth):
+                cur = env.vars
+                if cur is not None and name in cur:
+                    return cur[name]
+                env = env.up
+            return getattr(env, slot)
+        return get
+
+    # Other names get a monomorphic inline cache: the frame the dynamic
+    # part of the walk started from, and the value it found in a
+    # top-level frame, valid until the name is assigned anywhere.
+    base = value = None
+    version = -1
+
+    def get(env):
+        nonlocal base, value, version
+        for _ in range(depth):
+            cur = env.vars
+            if cur is not None and name in cur:
+                return cur[name]
+            env = env.up
+
+        v = VERSIONS.get(name, 0)
+        if env is base and v == version:
+            return value
+
+        env_ = env
+        while env is not None:
+            fn = env.fn
+            if fn is not None:
+                if name == fn.yname:
+                    return env.y
+                if name == fn.xname:
+                    return env.x
+                if name == "_f":
+                    return env.f
+            cur = env.vars
+            if cur is not None and name in cur:
+                if fn is None:
+                    base, value, version = env_, cur[name], v
+                return cur[name]
+            env = env.up
+        return None
+
+    return get
+
+def compile_ev(x, scope=None):
+    if isinstance(x, Var):
+        return compile_get(x.v, scope)
+    elif isinstance(x, Token):
+        v = x.v
+        return lambda env: String(v)
+    elif isinstance(x, Number):
+        n = int(x.v)
+        return lambda env: n
+    elif isinstance(x, Unquote):
+        return compile_ev(x.v, scope)
+    elif isinstance(x, Quote):
+        b = x.block
+        if b is not None:
+            return lambda env: b
+        v, hs = x.v, x.holes
+        return lambda env: Block(quasiquote(v, hs, env))
+    elif isinstance(x, ParsedArray):
+        if all(isinstance(x_, (Number, int)) for x_ in x.v):
+            # a literal of numbers is built once; `,` appends in place, so
+            # every evaluation hands out a copy
+            v = mkvec([int(x_.v) if isinstance(x_, Number) else x_ for x_ in x.v])
+            return lambda env: type(v)(v.v[:])
+        evs = [compile_ev(x_, scope) for x_ in x.v]
+        return lambda env: mkvec([ev(env) for ev in evs])
+    elif isinstance(x, tuple):
+        k = compile_(x, scope)
+        return lambda env: execute(k, env)
+    return lambda env: x
+
+def compile_(x, scope=None, tail=False):
+    # `tail` is set for nodes whose value is the value of the enclosing
+    # body; their steps run in the same execute() loop that entered the frame
+    if not isinstance(x, tuple):
+        ev = compile_ev(x, scope)
+        return lambda env: (None, ev(env))
+
+    evL = compile_ev(x[0], scope)
+    R = x[2]
+    op = x[1].v if isinstance(x[1], (Token, Var)) else None
+
+    # a possible `->` site: its body is compiled against the new frame and
+    # handed to functions that turn out to have exactly that layout; R in
+    # the current scope is only needed if H is not `->` after all
+    names = params(x[0]) if op == "->" else None
+    kbody = None
+    if names:
+        kbody = compile_(R, (names, scope), True)
+        kR = lambda env: code(R)(env)
+        evR = lambda env: execute(kR, env)
+    elif op in (";", "\\", "|") and tail:
+        # R is in tail position if H is what it looks like; tail code must
+        # not run as an argument, so that case gets its own code
+        kR = compile_(R, scope, True)
+        evR = lambda env: execute(code(R), env)
+    else:
+        kR = compile_(R, scope)
+        evR = (lambda env: execute(kR, env)) if isinstance(R, tuple) else compile_ev(R, scope)
+
+    if isinstance(x[1], Token):
+        # names in H position are looked up without materialising a String
+        Hname = x[1].v
+        get = compile_get(Hname, scope)
+        def evH(env):
+            H = get(env)
+            if H == NIL:
+                raise ValueError(f"FUNC {Hname} not found")
+            return H
+    else:
+        evH = compile_ev(x[1], scope)
+
+    def k(env):
+        L = evL(env)
+        H = evH(env)
+
+        if isinstance(H, String):
+            Hname = H.v
+            H = envget(env, Hname)
+            if H == NIL:
+                raise ValueError(f"FUNC {Hname} not found")
+
+        if isinstance(H, Special):
+            if H.fn is assign:
+                return None, assign_(L, evR(env), env)
+            y = H.fn(L, R, env)
+            if y is R:
+                return kR, env
+            if (kbody is not None and isinstance(y, Function) and y.body is R
+                    and y.env is env and (y.xname, y.yname) == names):
+                y.code = kbody
+            return resume(y, env)
+
+        R_ = evR(env)
+
+        if H is NIL:
+            return resume(L, env)
+        elif isinstance(H, Builtin):
+            return resume(H.fn(L, R_), env)
+        elif isinstance(H, Function):
+            # a function calling itself from tail position rebinds its frame
+            # in place, unless a closure has captured it; it ends up the same
+            # as Frame(H, L, R_, H.env), since env.fn is H and env.up H.env
+            if tail and H is env.fn and not env.captured:
+                env.f = H
+                env.x = L
+                env.y = R_
+                env.vars = None
+                return body(H), env
+            return body(H), Frame(H, L, R_, H.env)
+        raise ValueError(f"H type: {type(H).__name__}")
+
+    return k
+
 
 if __name__ == "__main__":
-    x = " ".join(sys.argv[1:])
+    args = sys.argv[1:]
+    if args and args[0] == "--demo":
+        OUT.throttle = .2
+        args.pop(0)
+    x = " ".join(args)
     x += "\0\0"
 
-    i, cs = [-1], []
     print("X", x)
-    y = parse(i, "\0", False, cs, x)
+    y = parse(x)
     print("Y", y)
 
     env = {
         "A": 123,
         **OPS,
     }
-    env = (env, None)
-    z = exe(y, env)
+    env = Frame(None, None, None, None, env)
+    z = execute(compile_(y), env)
+    OUT.flush()
     print("Z", z)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+# On-disk cache of parsed programs, in the spirit of __pycache__.
+#
+# Entries are pickled ASTs named by a hash of the source together with
+# everything the parse depends on: the cache format, the Python version
+# and the ASSOC precedence table. Changing any of them simply misses and
+# the stale entries age out. Hits touch the file's mtime, and writes evict
+# the least recently used entries once the directory exceeds `maxsize`.
+# The cache is best-effort: failing to read or write it never fails a run.
+
+import hashlib
+import os
+import pickle
+import sys
+from contextlib import suppress
+
+from c import ASSOC, parse
+
+FORMAT = b"zr3"
+DIR = os.environ.get("ZR_CACHE_DIR", os.path.expanduser("~/.cache/zrlang"))
+MAXSIZE = 64 << 20
+MISS = object()
+SIZES = {} # dirname -> its size as of the last scan, plus our writes since
+
+
+def key(xs):
+    h = hashlib.blake2b(digest_size=16)
+    h.update(FORMAT)
+    h.update(sys.implementation.cache_tag.encode())
+    h.update(repr(sorted(ASSOC.items())).encode())
+    h.update(xs.encode("utf-8", "surrogatepass"))
+    return h.hexdigest()
+
+def load(path):
+    try:
+        with open(path, "rb") as f:
+            if f.read(len(FORMAT)) != FORMAT:
+                return MISS
+            y = pickle.load(f)
+    except OSError:
+        return MISS
+    except Exception:
+        # truncated or foreign file: drop it and parse again
+        with suppress(OSError):
+            os.unlink(path)
+        return MISS
+    with suppress(OSError):
+        os.utime(path)
+    return y
+
+def store(path, y, dirname, maxsize):
+    # the cache is best-effort: if it can't be written, the run goes on
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(dirname, exist_ok=True)
+        with open(tmp, "wb") as f:
+            f.write(FORMAT)
+            pickle.dump(y, f, pickle.HIGHEST_PROTOCOL)
+            size = f.tell()
+        os.replace(tmp, path)
+    except (OSError, RecursionError):
+        # unwritable, or too deeply nested to pickle
+        with suppress(OSError):
+            os.unlink(tmp)
+        return
+    # rescan only when our estimate says the cap is reached; writes from
+    # other processes are only seen by the next scan
+    total = SIZES.get(dirname)
+    if total is None or total + size > maxsize:
+        with suppress(OSError):
+            SIZES[dirname] = evict(dirname, maxsize)
+    else:
+        SIZES[dirname] = total + size
+
+def evict(dirname, maxsize):
+    # once over maxsize, evicts down to 3/4 of it so that the next scan is
+    # a while off; returns the size left
+    entries = []
+    total = 0
+    for e in os.scandir(dirname):
+        if e.name.endswith(".zrc"):
+            try:
+                st = e.stat()
+            except OSError:
+                # removed by another process meanwhile
+                continue
+            entries.append((st.st_mtime, st.st_size, e.path))
+            total += st.st_size
+    if total <= maxsize:
+        return total
+    entries.sort()
+    for _, size, path in entries:
+        if total <= maxsize * 3 // 4:
+            break
+        with suppress(OSError):
+            os.unlink(path)
+        total -= size
+    return total
+
+def parse_cached(xs, dirname=None, maxsize=MAXSIZE):
+    dirname = dirname or DIR
+    path = os.path.join(dirname, key(xs) + ".zrc")
+    y = load(path)
+    if y is MISS:
+        y = parse(xs)
+        store(path, y, dirname, maxsize)
+    return y
+
+def parse_file(filename, dirname=None, maxsize=MAXSIZE):
+    with open(filename) as f:
+        xs = f.read() + "\0\0"
+    return parse_cached(xs, dirname, maxsize)
+
+
+if __name__ == "__main__":
+    # warm the cache for the given files
+    for filename in sys.argv[1:]:
+        parse_file(filename)
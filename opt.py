@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+
+# Optimisation pass over the shunted AST, run between parse() and
+# execution. It assumes operator names are bound as in OPS: names the
+# program itself may rebind (literal `=` and `->` targets) are never
+# folded, and if the program binds names it can't see statically, or
+# handles `=`/`->` as values, only literals are converted.
+
+import sys
+from dataclasses import dataclass, field
+
+from c import (
+    NIL, OPS, Number, ParsedArray, Quote, String, Token, Unquote, Var, parse,
+)
+
+PURE = {"+", "*", "-", "==", "?", "~"}
+BINDERS = {"=", "->"}
+CONSTS = (int, str, type(NIL))
+
+
+@dataclass
+class Stats:
+    nodes: int = 0
+    removed: int = 0
+    folded: int = 0
+    sequences: int = 0
+    branches: int = 0
+    pool: dict = field(default_factory=dict)
+
+    def __str__(self):
+        return (f"{self.nodes} nodes, {self.removed} removed: "
+                f"{self.folded} folded, {self.sequences} sequences inlined, "
+                f"{self.branches} branches pruned, {len(self.pool)} constants")
+
+
+def names(x):
+    # names bound by a literal `=`/`->` left side, None if not literal
+    if isinstance(x, str):
+        return {x}
+    if isinstance(x, tuple) and isinstance(x[1], (Token, Var)) and x[1].v == ":":
+        a, b = names(x[0]), names(x[2])
+        if a is not None and b is not None:
+            return a | b
+    return None
+
+def unquotes(x):
+    # the code of every Unquote in a quote template, nested ones included,
+    # walked as quotevars() in c.py does; the rest of a template is data
+    if isinstance(x, Unquote):
+        yield x.v
+    elif isinstance(x, (tuple, list)):
+        for x_ in x:
+            yield from unquotes(x_)
+
+def template(x, f):
+    # a quote template with f applied to the code of each Unquote
+    if isinstance(x, Unquote):
+        return Unquote(f(x.v))
+    elif isinstance(x, (tuple, list)):
+        return type(x)(template(x_, f) for x_ in x)
+    return x
+
+def bound(x, acc):
+    # collect names the program may bind; False if that can't be known
+    if isinstance(x, tuple):
+        L, H, R = x
+        if isinstance(H, (Token, Var)):
+            if H.v in BINDERS:
+                ns = names(L)
+                if ns is None:
+                    return False
+                acc |= ns
+        elif not bound(H, acc):
+            return False
+        return bound(L, acc) and bound(R, acc)
+    elif isinstance(x, (Token, Var, String)):
+        return x.v not in BINDERS
+    elif isinstance(x, Unquote):
+        return bound(x.v, acc)
+    elif isinstance(x, Quote):
+        return all(bound(y, acc) for y in unquotes(x.v))
+    elif isinstance(x, ParsedArray):
+        return all(bound(x_, acc) for x_ in x.v)
+    return True
+
+
+def pure(x):
+    return isinstance(x, (Var, Token, String) + CONSTS)
+
+def head(H, safe):
+    if isinstance(H, (Token, Var)) and H.v in safe:
+        return H.v
+    return None
+
+def opt(x, st, safe):
+    st.nodes += 1
+
+    if isinstance(x, Number):
+        return st.pool.setdefault(x.v, int(x.v))
+    elif isinstance(x, Unquote):
+        return Unquote(opt(x.v, st, safe))
+    elif isinstance(x, Quote):
+        return Quote(template(x.v, lambda y: opt(y, st, safe)))
+    elif isinstance(x, ParsedArray):
+        return ParsedArray([opt(x_, st, safe) for x_ in x.v])
+    elif not isinstance(x, tuple):
+        return x
+
+    L = opt(x[0], st, safe)
+    H = x[1] if isinstance(x[1], (Token, Var)) else opt(x[1], st, safe)
+    R = opt(x[2], st, safe)
+    op = head(H, safe)
+
+    if op in (";", "\\") and pure(L):
+        st.sequences += 1
+        return R
+    elif op == "|" and isinstance(L, CONSTS):
+        st.branches += 1
+        return R if L == NIL else L
+    elif op == "?" and isinstance(L, CONSTS) and (L != NIL or pure(R)):
+        st.branches += 1
+        return R if L != NIL else NIL
+    elif op in PURE and isinstance(L, CONSTS) and isinstance(R, CONSTS):
+        try:
+            y = OPS[op].fn(L, R)
+        except Exception:
+            # leave the error to run time
+            return (L, H, R)
+        if isinstance(y, CONSTS):
+            st.folded += 1
+            return y
+
+    return (L, H, R)
+
+def optimize(x):
+    st = Stats()
+    acc = set()
+    if bound(x, acc):
+        safe = {op for op in OPS if op not in acc} & (PURE | {";", "\\", "|"})
+    else:
+        safe = set()
+    y = opt(x, st, safe)
+    st.removed = st.nodes - count(y)
+    return y, st
+
+def count(x):
+    if isinstance(x, tuple):
+        n = 1 + count(x[0]) + count(x[2])
+        if not isinstance(x[1], (Token, Var)):
+            n += count(x[1])
+        return n
+    elif isinstance(x, Unquote):
+        return 1 + count(x.v)
+    elif isinstance(x, Quote):
+        return 1 + sum(count(y) for y in unquotes(x.v))
+    elif isinstance(x, ParsedArray):
+        return 1 + sum(count(x_) for x_ in x.v)
+    return 1
+
+
+if __name__ == "__main__":
+    with open(sys.argv[1]) as f:
+        x = f.read() + "\0\0"
+    y, st = optimize(parse(x))
+    print(y)
+    print(st, file=sys.stderr)
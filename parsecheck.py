@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+
+# Differential check of the parser: parse() against the per-character
+# scanner it replaced, on random inputs.
+#
+#   python parsecheck.py [-n COUNT] [-s SEED]
+#
+# The old scanner is kept below as the reference. Both hand their levels to
+# the same _finalize(), so this checks tokenize() and parse_() only: every
+# input must give the same AST, down to the node types, or the same error
+# message. Mismatches are printed and the exit status is 1.
+
+import random
+import sys
+
+from c import (
+    Comment, Number, RawString, String, Token, Value,
+    _finalize, opposite_paren, parse,
+)
+
+ALPHABET = [
+    "a", "b", "x1", "_f", "0", "12", " ", "  ", "\n", "+", "-", "*", "=",
+    "==", "->", ":", ",", ";", "|", "?", "@", "~", "\\", "(", ")", "[", "]",
+    "{", "}", "(|", "|)", "[|", "|]", "{|", "|}", "'", "\"", "#", "\\\"",
+    "\\n", "\\t", ".",
+]
+
+
+def old_rawstring(i, cs, xs):
+    while True:
+        i[0] += 1
+        c = xs[i[0]]
+        if c == "\n":
+            return "".join(cs)
+        elif c == "\0":
+            i[0] -= 1
+            return "".join(cs)
+        cs.append(c)
+
+def old_string(i, cs, xs):
+    escape = False
+    while True:
+        i[0] += 1
+        c = xs[i[0]]
+        if escape:
+            if c == "n":
+                cs.append("\n")
+            elif c == "t":
+                cs.append("\t")
+            elif c in "\"\\":
+                cs.append(c)
+            else:
+                cs.append("\\")
+                cs.append(c)
+            escape = False
+            continue
+        if c == '"':
+            return "".join(cs)
+        elif c == "\\":
+            escape = True
+            continue
+        elif c == "\0":
+            break
+        cs.append(c)
+    raise ValueError(f"unterminated string: {''.join(cs)}")
+
+def old_parse(i, start_paren, quote, cs, xs):
+    buf = []
+    token = None
+    leading_punct = False
+
+    while i[0] + 1 < len(xs):
+        i[0] += 1
+        c, c1 = xs[i[0]], xs[i[0] + 1]
+
+        if c.isalnum() or c in "_":
+            new_token = "symbol"
+        elif c in ' ()[]{}"#\'\n\0':
+            new_token = None
+        else:
+            new_token = "punct"
+
+        if new_token != token and token is not None:
+            if len(buf) == 0 and token == "punct":
+                leading_punct = True
+            cs_ = "".join(cs)
+            if token == "symbol" and all(x.isnumeric() for x in cs_):
+                cs_ = Number(cs_)
+            else:
+                cs_ = Token(cs_)
+            buf.append(cs_)
+            cs.clear()
+
+        if new_token is not None:
+            cs.append(c)
+        token = new_token
+
+        if c in " \n":
+            continue
+        elif c == "#":
+            x = old_rawstring(i, cs, xs)
+            cs.clear()
+            buf.append(Comment(x))
+        elif c == "'":
+            x = old_rawstring(i, cs, xs)
+            cs.clear()
+            buf.append(RawString(x))
+        elif c == '"':
+            x = old_string(i, cs, xs)
+            cs.clear()
+            buf.append(String(x))
+        elif c in "([{":
+            quote_ = c1 == "|"
+            if quote_:
+                i[0] += 1
+            x = old_parse(i, c, quote_, cs, xs)
+            cs.clear()
+            buf.append(x)
+        elif c == "|" and c1 in ")]}":
+            i[0] += 1
+            c = xs[i[0]]
+            if opposite_paren(start_paren) != c or not quote:
+                start_paren = start_paren if start_paren != "\0" else "$"
+                raise ValueError(f"Parens don't match: {start_paren} <> |{c}")
+            return _finalize(buf, leading_punct, start_paren, c, quote)
+        elif c in ")]}\0":
+            if opposite_paren(start_paren) != c or quote:
+                start_paren = start_paren if start_paren != "\0" else "$"
+                start_paren = ("|" if quote else "") + start_paren
+                end_paren = c if c != "\0" else "$"
+                raise ValueError(f"Parens don't match: {start_paren} <> {end_paren}")
+            return _finalize(buf, leading_punct, start_paren, c, quote)
+
+    assert False
+
+
+def shape(x):
+    # reprs don't tell a Token from a Var or a String from a RawString
+    if isinstance(x, (tuple, list)):
+        return type(x).__name__, [shape(x_) for x_ in x]
+    elif isinstance(x, Value):
+        return type(x).__name__, shape(x.v)
+    return x
+
+def outcome(f, xs):
+    try:
+        return shape(f(xs))
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+
+def check(xs):
+    xs += "\0\0"
+    old = outcome(lambda xs: old_parse([-1], "\0", False, [], xs), xs)
+    new = outcome(parse, xs)
+    return old == new, old, new
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    count, seed = 100000, 0
+    while args and args[0] in ("-n", "-s"):
+        flag, value = args[0], int(args[1])
+        args = args[2:]
+        if flag == "-n":
+            count = value
+        else:
+            seed = value
+
+    rng = random.Random(seed)
+    bad = 0
+    for _ in range(count):
+        xs = "".join(rng.choices(ALPHABET, k=rng.randrange(24)))
+        ok, old, new = check(xs)
+        if not ok:
+            bad += 1
+            if bad <= 10:
+                print(f"{xs!r}\n  old: {old}\n  new: {new}")
+    print(f"{count} inputs, {bad} mismatches")
+    sys.exit(1 if bad else 0)
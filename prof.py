@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+
+# Deterministic profiler for the closure-compiling engine.
+#
+# enable() swaps c.execute and c.body for recording versions, so normal
+# runs pay nothing for it. A Function's activation starts when the first
+# step of its body runs and ends when the execute() loop running it
+# returns. Calls in tail position share their caller's loop and finish
+# together with it, so each gets the inclusive time it would have without
+# tail calls; recursive activations count towards inclusive time once.
+# Builtins in the root environment are wrapped to show up as calls too.
+#
+# Between two events, exclusive time goes to whatever is on top of the
+# stack, and so does the change in memory traced by tracemalloc when run
+# with -m (it slows everything down, so it's off by default).
+#
+#   python prof.py [-m] [-o PATH] FILE
+#
+# runs FILE, prints a table sorted by exclusive time to stderr and writes
+# PATH.json and PATH.pstats, the latter readable by pstats.Stats.
+#
+# Sampling mode leaves the engine alone. Every execute() loop holds the
+# Frame it is running in, so the Python frames of execute() already form
+# a shadow stack of zrlang activations; a SIGPROF timer (or a thread where
+# there is none) walks it every interval and counts the stacks by the
+# names of the running Functions, tail calls showing as their callee.
+#
+#   python prof.py -s [-i MS] [-o PATH] FILE
+#
+# writes PATH.folded in the collapsed stack format of flamegraph.pl and
+# speedscope.
+
+import json
+import marshal
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+
+import c
+from cache import parse_file
+from c import OPS, OUT, Builtin, Frame, Special, compile_
+
+EXECUTE = c.execute
+BODY = c.body
+
+KIND, CALLS, TOTTIME, CUMTIME, ALLOC, CALLERS = range(6)
+
+
+def traced():
+    return tracemalloc.get_traced_memory()[0]
+
+
+class Profiler:
+    def __init__(self):
+        self.stats = {} # name -> [kind, calls, tottime, cumtime, alloc, callers]
+        self.stack = []
+        self.active = {}
+        self.steps = {}
+        self.reset()
+
+    def reset(self):
+        # called last in every event, so bookkeeping isn't charged to anyone
+        self.last = time.perf_counter()
+        self.traced = traced()
+
+    def tick(self):
+        t = time.perf_counter()
+        if self.stack:
+            st = self.stats[self.stack[-1][0]]
+            st[TOTTIME] += t - self.last
+            st[ALLOC] += traced() - self.traced
+        return t
+
+    def enter(self, name, kind):
+        t = self.tick()
+        st = self.stats.get(name)
+        if st is None:
+            st = self.stats[name] = [kind, 0, 0.0, 0.0, 0, {}]
+        st[CALLS] += 1
+        if self.stack:
+            caller = self.stack[-1][0]
+            st[CALLERS][caller] = st[CALLERS].get(caller, 0) + 1
+        self.active[name] = self.active.get(name, 0) + 1
+        self.stack.append((name, t))
+        self.reset()
+
+    def leave(self, mark):
+        t = self.tick()
+        stack, active = self.stack, self.active
+        while len(stack) > mark:
+            name, t0 = stack.pop()
+            active[name] -= 1
+            if not active[name]:
+                self.stats[name][CUMTIME] += t - t0
+        self.reset()
+
+    def execute(self, k, env):
+        mark = len(self.stack)
+        try:
+            return EXECUTE(k, env)
+        finally:
+            self.leave(mark)
+
+    def body(self, fn):
+        k = BODY(fn)
+        name = fn.name or "<lambda>"
+        step = self.steps.get((k, name))
+        if step is None:
+            enter = self.enter
+            def step(env):
+                enter(name, "function")
+                return k(env)
+            self.steps[k, name] = step
+        return step
+
+    def builtin(self, name, fn):
+        def call(a, b):
+            mark = len(self.stack)
+            self.enter(name, "builtin")
+            try:
+                return fn(a, b)
+            finally:
+                self.leave(mark)
+        return Builtin(call)
+
+
+class Sampler:
+    def __init__(self, interval=.001):
+        self.interval = interval
+        self.counts = {}
+        self.code = EXECUTE.__code__
+
+    def sample(self, f):
+        names = []
+        env = None
+        while f is not None:
+            if f.f_code is self.code:
+                env_ = f.f_locals["env"]
+                # nested execute() loops of one activation share its Frame
+                if env_ is not env and isinstance(env_, Frame):
+                    env = env_
+                    fn = env.fn
+                    names.append(fn.name or "<lambda>" if fn is not None else "<main>")
+            f = f.f_back
+        if names:
+            stack = ";".join(reversed(names))
+            self.counts[stack] = self.counts.get(stack, 0) + 1
+
+    def start(self):
+        if hasattr(signal, "setitimer"):
+            signal.signal(signal.SIGPROF, lambda signum, f: self.sample(f))
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        else:
+            self.running = True
+            main = threading.main_thread().ident
+            def loop():
+                while self.running:
+                    time.sleep(self.interval)
+                    self.sample(sys._current_frames().get(main))
+            threading.Thread(target=loop, daemon=True).start()
+
+    def stop(self):
+        if hasattr(signal, "setitimer"):
+            signal.setitimer(signal.ITIMER_PROF, 0)
+            signal.signal(signal.SIGPROF, signal.SIG_DFL)
+        else:
+            self.running = False
+
+    def write(self, file):
+        for stack, n in sorted(self.counts.items()):
+            print(stack, n, file=file)
+
+
+def enable(prof):
+    c.execute, c.body = prof.execute, prof.body
+
+def disable():
+    c.execute, c.body = EXECUTE, BODY
+
+def run(y, prof):
+    env = {
+        name: prof.builtin(name, b.fn) if not isinstance(b, Special) else b
+        for name, b in OPS.items()
+    }
+    enable(prof)
+    prof.enter("<main>", "main")
+    try:
+        return c.execute(compile_(y), Frame(None, None, None, None, env))
+    finally:
+        prof.leave(0)
+        disable()
+
+
+def table(stats, file=None):
+    print(f"{'calls':>9} {'tottime':>10} {'cumtime':>10} {'alloc':>10}  name", file=file)
+    for name, st in sorted(stats.items(), key=lambda kv: -kv[1][TOTTIME]):
+        print(f"{st[CALLS]:9} {st[TOTTIME]:10.6f} {st[CUMTIME]:10.6f} "
+              f"{st[ALLOC]:10}  {name}", file=file)
+
+def to_json(stats):
+    return [
+        {"name": name, "kind": st[KIND], "calls": st[CALLS],
+         "tottime": st[TOTTIME], "cumtime": st[CUMTIME],
+         "alloc": st[ALLOC], "callers": st[CALLERS]}
+        for name, st in stats.items()
+    ]
+
+def to_pstats(stats):
+    # the dict cProfile marshals: (file, line, name) ->
+    # (primitive calls, calls, tottime, cumtime, callers)
+    def key(name):
+        if stats[name][KIND] == "builtin":
+            return "~", 0, f"<{name}>"
+        return "<zr>", 0, name
+    return {
+        key(name): (st[CALLS], st[CALLS], st[TOTTIME], st[CUMTIME],
+                    {key(caller): (n, n, 0.0, 0.0) for caller, n in st[CALLERS].items()})
+        for name, st in stats.items()
+    }
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    path = "zrprof"
+    interval = None
+    while args[0] in ("-m", "-o", "-s", "-i"):
+        flag = args.pop(0)
+        if flag == "-m":
+            tracemalloc.start()
+        elif flag == "-o":
+            path = args.pop(0)
+        elif flag == "-s":
+            interval = interval or .001
+        else:
+            interval = float(args.pop(0)) / 1000
+
+    y = parse_file(args[0])
+    if interval is not None:
+        sampler = Sampler(interval)
+        sampler.start()
+        try:
+            z = c.execute(compile_(y), Frame(None, None, None, None, {**OPS}))
+        finally:
+            sampler.stop()
+        OUT.flush()
+        print(z)
+        with open(path + ".folded", "w") as f:
+            sampler.write(f)
+    else:
+        prof = Profiler()
+        z = run(y, prof)
+        OUT.flush()
+        print(z)
+
+        table(prof.stats, sys.stderr)
+        with open(path + ".json", "w") as f:
+            json.dump(to_json(prof.stats), f, indent=1)
+        with open(path + ".pstats", "wb") as f:
+            marshal.dump(to_pstats(prof.stats), f)
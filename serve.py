@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+# Warm evaluation daemon on a Unix socket, and its client.
+#
+#   python serve.py serve [-w WORKERS] [-p PRELUDE.tvl] SOCKET
+#   python serve.py SOCKET [FILE]
+#
+# The server runs the prelude once into a root frame over OPS, then forks
+# WORKERS processes that accept connections on the same socket, sharing
+# the prelude copy-on-write. Each request runs in a fresh child frame of
+# the root: it sees the prelude's names, and its own assignments go to the
+# child and vanish with it. Values are not copied, though, so a request
+# appending to a prelude Array changes it for later requests in that worker.
+#
+# Every message is a 4 byte big-endian length followed by that many bytes.
+# Requests are zrlang source in UTF-8, responses JSON objects with "ok",
+# "value" or "error", and "output", what `pr` wrote. A connection may carry
+# any number of requests. Recently seen sources keep their parsed AST, and
+# with it the closure compiler's code for them. A request that isn't UTF-8
+# gets an error response; anything else going wrong with a connection drops
+# just that connection, and a worker that dies anyway is replaced.
+
+import gc
+import io
+import json
+import os
+import signal
+import socket
+import struct
+import sys
+from collections import OrderedDict
+
+from cache import parse_file
+from c import OPS, OUT, Frame, compile_, execute, parse
+
+HEADER = struct.Struct(">I")
+PARSED_SIZE = 256
+
+
+def recvall(sock, n):
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            if buf:
+                raise ConnectionError("connection closed mid-message")
+            return None
+        buf += chunk
+    return bytes(buf)
+
+def send(sock, data):
+    sock.sendall(HEADER.pack(len(data)) + data)
+
+def recv(sock):
+    header = recvall(sock, HEADER.size)
+    if header is None:
+        return None
+    return recvall(sock, HEADER.unpack(header)[0]) or b""
+
+
+class Session:
+    def __init__(self, root):
+        self.root = root
+        self.parsed = OrderedDict()
+
+    def parse(self, src):
+        y = self.parsed.get(src)
+        if y is None:
+            y = self.parsed[src] = parse(src + "\0\0")
+            if len(self.parsed) > PARSED_SIZE:
+                self.parsed.popitem(last=False)
+        else:
+            self.parsed.move_to_end(src)
+        return y
+
+    def evaluate(self, src):
+        r = {}
+        out = OUT.sink = io.StringIO()
+        try:
+            z = execute(compile_(self.parse(src)), Frame(None, None, None, self.root))
+            r["ok"] = True
+            r["value"] = str(z)
+        except Exception as e:
+            r["ok"] = False
+            r["error"] = f"{type(e).__name__}: {e}"
+        OUT.flush()
+        r["output"] = out.getvalue()
+        return r
+
+    def handle(self, req):
+        try:
+            src = req.decode("utf-8", "surrogatepass")
+        except UnicodeDecodeError as e:
+            return {"ok": False, "error": f"{type(e).__name__}: {e}", "output": ""}
+        return self.evaluate(src)
+
+    def serve(self, sock):
+        while True:
+            conn, _ = sock.accept()
+            with conn:
+                try:
+                    while (req := recv(conn)) is not None:
+                        send(conn, json.dumps(self.handle(req)).encode())
+                except ConnectionError:
+                    pass
+                except Exception as e:
+                    print(f"serve: dropping connection: {type(e).__name__}: {e}",
+                          file=sys.stderr)
+
+def spawn(sock, root):
+    pid = os.fork()
+    if pid == 0:
+        try:
+            Session(root).serve(sock)
+        finally:
+            os._exit(0)
+    return pid
+
+def serve(path, prelude=None, workers=1):
+    root = Frame(None, None, None, None, {**OPS})
+    if prelude is not None:
+        execute(compile_(parse_file(prelude)), root)
+    # keep the prelude out of the collector, so forks share its pages
+    gc.freeze()
+
+    if os.path.exists(path):
+        os.unlink(path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    sock.listen(128)
+
+    # clean up on kill as well as on ^C
+    signal.signal(signal.SIGTERM, lambda signum, f: sys.exit(0))
+    pids = set()
+    try:
+        for _ in range(workers):
+            pids.add(spawn(sock, root))
+        # runs until killed, replacing workers that exit
+        while True:
+            pid, status = os.wait()
+            if pid in pids:
+                pids.remove(pid)
+                print(f"serve: worker {pid} exited ({status}), respawning",
+                      file=sys.stderr)
+                pids.add(spawn(sock, root))
+    finally:
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        os.unlink(path)
+
+
+class Client:
+    def __init__(self, path):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+
+    def eval(self, src):
+        send(self.sock, src.encode("utf-8", "surrogatepass"))
+        return json.loads(recv(self.sock))
+
+    def close(self):
+        self.sock.close()
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args[0] == "serve":
+        args.pop(0)
+        workers, prelude = os.cpu_count(), None
+        while args[0] in ("-w", "-p"):
+            flag, value = args[0], args[1]
+            args = args[2:]
+            if flag == "-w":
+                workers = int(value)
+            else:
+                prelude = value
+        serve(args[0], prelude, workers)
+    else:
+        if len(args) > 1:
+            with open(args[1]) as f:
+                src = f.read()
+        else:
+            src = sys.stdin.read()
+        r = Client(args[0]).eval(src)
+        sys.stdout.write(r["output"])
+        if r["ok"]:
+            print(r["value"])
+        else:
+            print(r["error"], file=sys.stderr)
+            sys.exit(1)
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+
+# Bytecode compiler and stack VM for the c.py language.
+#
+# A Code object is a flat list of (op, arg) words plus a constants pool and
+# a table of variable getters. Operator heads are only known at run time,
+# so the operators with their own opcodes (`;` `\` `|` `?` `=` `->`) are
+# guarded by identity against the OPS builtins they were compiled for; on a
+# mismatch the site falls back to generic().
+
+import sys
+
+from cache import parse_cached
+from opt import optimize
+from c import (
+    NIL, OPS, OUT, NODES, Block, Builtin, Frame, Function, Number,
+    ParsedArray, Quote, Special, String, Token, Unquote, Var,
+    assign_, compile_get, envget, mkvec, params, quasiquote,
+)
+
+(
+    LOAD_VAR, LOAD_CONST, LOAD_HEAD, LOAD_STR, SPECIAL,
+    CALL_BUILTIN, CALL_FUNC, RETURN, SEQ, JUMP_IF_NIL,
+    JUMP_IF_NOT_NIL, ASSIGN, STORE, MAKE_CLOSURE, BUILD_ARRAY,
+    QUOTE,
+) = range(16)
+OPNAMES = [
+    "LOAD_VAR", "LOAD_CONST", "LOAD_HEAD", "LOAD_STR", "SPECIAL",
+    "CALL_BUILTIN", "CALL_FUNC", "RETURN", "SEQ", "JUMP_IF_NIL",
+    "JUMP_IF_NOT_NIL", "ASSIGN", "STORE", "MAKE_CLOSURE", "BUILD_ARRAY",
+    "QUOTE",
+]
+
+PASS = object() # H left by SPECIAL when the special handed back R
+
+
+class Code:
+    def __init__(self, node):
+        self.node = node
+        self.ops = []
+        self.consts = []
+        self.getters = []
+        self.names = []
+
+
+def pure(x):
+    return not isinstance(x, (tuple, Unquote, Quote, ParsedArray))
+
+class Compiler:
+    def __init__(self, node, scope):
+        self.code = Code(node)
+        self.scope = scope
+
+    def emit(self, op, arg=0):
+        self.code.ops += [op, arg]
+
+    def const(self, v):
+        self.code.consts.append(v)
+        return len(self.code.consts) - 1
+
+    def here(self):
+        return len(self.code.ops)
+
+    def getter(self, name):
+        self.code.getters.append(compile_get(name, self.scope))
+        self.code.names.append(name)
+        return len(self.code.getters) - 1
+
+    def expr(self, x):
+        if isinstance(x, tuple):
+            self.site(x)
+        elif isinstance(x, Var):
+            self.emit(LOAD_VAR, self.getter(x.v))
+        elif isinstance(x, Token):
+            self.emit(LOAD_STR, self.const(x.v))
+        elif isinstance(x, Number):
+            self.emit(LOAD_CONST, self.const(int(x.v)))
+        elif isinstance(x, Unquote):
+            self.expr(x.v)
+        elif isinstance(x, Quote):
+            self.emit(QUOTE, self.const(x))
+        elif isinstance(x, ParsedArray):
+            for x_ in x.v:
+                self.expr(x_)
+            self.emit(BUILD_ARRAY, len(x.v))
+        else:
+            self.emit(LOAD_CONST, self.const(x))
+
+    def site(self, x):
+        L, H, R = x
+        consts = self.code.consts
+
+        self.expr(L)
+        if isinstance(H, Token):
+            self.emit(LOAD_HEAD, self.getter(H.v))
+        else:
+            self.expr(H)
+
+        op = H.v if isinstance(H, (Token, Var)) else None
+        if op in (";", "\\", "|"):
+            i = self.const(None)
+            self.emit(SEQ if op != "|" else JUMP_IF_NOT_NIL, i)
+            self.expr(R)
+            consts[i] = (OPS[op], R, self.here())
+        elif op == "=":
+            i = self.const(None)
+            self.emit(ASSIGN, i)
+            self.expr(R)
+            self.emit(STORE)
+            consts[i] = (OPS[op], R, self.here())
+        elif op == "->":
+            names = params(L)
+            body = compile_(R, (names, self.scope)) if names else None
+            self.emit(MAKE_CLOSURE, self.const((OPS[op], R, names, body)))
+        else:
+            j = None
+            if op == "?" and pure(R):
+                j = self.const(None)
+                self.emit(JUMP_IF_NIL, j)
+            i = self.const(None)
+            self.emit(SPECIAL, i)
+            self.expr(R)
+            builtin = isinstance(OPS.get(op), Builtin)
+            self.emit(CALL_BUILTIN if builtin else CALL_FUNC)
+            consts[i] = (R, self.here())
+            if j is not None:
+                consts[j] = (OPS[op], self.here())
+
+def compile_(x, scope=None):
+    cc = Compiler(x, scope)
+    cc.expr(x)
+    cc.emit(RETURN)
+    return cc.code
+
+
+CODES = {}
+
+def code(x):
+    k = CODES.get(id(x))
+    if k is None or k[0] is not x:
+        k = CODES[id(x)] = (x, compile_(x))
+    return k[1]
+
+def body(fn):
+    if fn.bytecode is None:
+        fn.bytecode = code(fn.body)
+    return fn.bytecode
+
+def settle(x, env):
+    if isinstance(x, NODES):
+        return run(code(x), env)
+    return x
+
+def generic(L, H, R, env):
+    if isinstance(H, String):
+        Hname = H.v
+        H = envget(env, Hname)
+        if H == NIL:
+            raise ValueError(f"FUNC {Hname} not found")
+
+    if isinstance(H, Special):
+        return settle(H.fn(L, R, env), env)
+
+    R = run(code(R), env)
+
+    if H is NIL:
+        return settle(L, env)
+    elif isinstance(H, Builtin):
+        return settle(H.fn(L, R), env)
+    elif isinstance(H, Function):
+        return run(body(H), Frame(H, L, R, H.env))
+    raise ValueError(f"H type: {type(H).__name__}")
+
+
+def run(code, env):
+    stack, frames = [], []
+    push, pop = stack.append, stack.pop
+    ops, consts, getters = code.ops, code.consts, code.getters
+    pc = 0
+
+    while True:
+        op = ops[pc]
+        arg = ops[pc + 1]
+        pc += 2
+
+        if op == LOAD_VAR:
+            push(getters[arg](env))
+        elif op == LOAD_CONST:
+            push(consts[arg])
+        elif op == LOAD_HEAD:
+            H = getters[arg](env)
+            if H == NIL:
+                raise ValueError(f"FUNC {code.names[arg]} not found")
+            push(H)
+        elif op == SPECIAL:
+            H = stack[-1]
+            if isinstance(H, String):
+                Hname = H.v
+                H = stack[-1] = envget(env, Hname)
+                if H == NIL:
+                    raise ValueError(f"FUNC {Hname} not found")
+            if isinstance(H, Special):
+                R, end = consts[arg]
+                pop()
+                y = H.fn(pop(), R, env)
+                if y is R:
+                    push(NIL)
+                    push(PASS)
+                else:
+                    push(settle(y, env))
+                    pc = end
+        elif op == CALL_BUILTIN or op == CALL_FUNC:
+            R = pop()
+            H = pop()
+            L = pop()
+            if type(H) is Builtin:
+                y = H.fn(L, R)
+                push(run(code(y), env) if isinstance(y, NODES) else y)
+            elif isinstance(H, Function):
+                if ops[pc] != RETURN:
+                    frames.append((code, pc, env))
+                env = Frame(H, L, R, H.env)
+                code = body(H)
+                ops, consts, getters = code.ops, code.consts, code.getters
+                pc = 0
+            elif H is PASS:
+                push(R)
+            elif H is NIL:
+                push(settle(L, env))
+            elif isinstance(H, Builtin):
+                push(settle(H.fn(L, R), env))
+            else:
+                raise ValueError(f"H type: {type(H).__name__}")
+        elif op == RETURN:
+            if not frames:
+                return pop()
+            code, pc, env = frames.pop()
+            ops, consts, getters = code.ops, code.consts, code.getters
+        elif op == JUMP_IF_NOT_NIL:
+            H = pop()
+            expected, R, end = consts[arg]
+            if H is not expected:
+                push(generic(pop(), H, R, env))
+                pc = end
+            elif stack[-1] != NIL:
+                pc = end
+            else:
+                pop()
+        elif op == JUMP_IF_NIL:
+            expected, end = consts[arg]
+            if stack[-1] is expected and stack[-2] == NIL:
+                pop()
+                pc = end
+        elif op == SEQ:
+            H = pop()
+            expected, R, end = consts[arg]
+            if H is not expected:
+                push(generic(pop(), H, R, env))
+                pc = end
+            else:
+                pop()
+        elif op == LOAD_STR:
+            push(String(consts[arg]))
+        elif op == MAKE_CLOSURE:
+            H = pop()
+            expected, R, names, k = consts[arg]
+            if H is not expected:
+                push(generic(pop(), H, R, env))
+                continue
+            y = H.fn(pop(), R, env)
+            if (k is not None and isinstance(y, Function) and y.body is R
+                    and y.env is env and (y.xname, y.yname) == names):
+                y.bytecode = k
+            push(settle(y, env))
+        elif op == ASSIGN:
+            H = pop()
+            expected, R, end = consts[arg]
+            if H is not expected:
+                push(generic(pop(), H, R, env))
+                pc = end
+        elif op == STORE:
+            R = pop()
+            push(assign_(pop(), R, env))
+        elif op == BUILD_ARRAY:
+            xs = stack[len(stack) - arg:]
+            del stack[len(stack) - arg:]
+            push(mkvec(xs))
+        elif op == QUOTE:
+            q = consts[arg]
+            push(q.block if q.block is not None else Block(quasiquote(q.v, q.holes, env)))
+        else:
+            raise ValueError(f"bad opcode {op}")
+
+
+def dis(code, file=None):
+    todo, seen = [code], set()
+    while todo:
+        code = todo.pop(0)
+        if id(code) in seen:
+            continue
+        seen.add(id(code))
+        print(f"code {id(code):#x}:", file=file)
+        ops = code.ops
+        for pc in range(0, len(ops), 2):
+            op, arg = ops[pc], ops[pc + 1]
+            name = OPNAMES[op]
+            note = ""
+            if op in (LOAD_VAR, LOAD_HEAD):
+                note = code.names[arg]
+            elif op in (LOAD_CONST, LOAD_STR, QUOTE):
+                note = repr(code.consts[arg])
+            elif op in (SEQ, JUMP_IF_NOT_NIL, ASSIGN, JUMP_IF_NIL, SPECIAL):
+                note = f"to {code.consts[arg][-1]}"
+            elif op == MAKE_CLOSURE:
+                _, _, names, k = code.consts[arg]
+                if k is not None:
+                    note = f"{names[0]}:{names[1]} code {id(k):#x}"
+                    todo.append(k)
+                else:
+                    note = "dynamic"
+            print(f"  {pc:5} {name:16} {arg:3}  {note}".rstrip(), file=file)
+        print(file=file)
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    flags = set()
+    while args[0] in ("-d", "-O", "--demo"):
+        flags.add(args.pop(0))
+    if "--demo" in flags:
+        OUT.throttle = .2
+    with open(args[0]) as f:
+        x = f.read() + "\0\0"
+
+    y = parse_cached(x)
+    if "-O" in flags:
+        y, st = optimize(y)
+        print(st, file=sys.stderr)
+    k = compile_(y)
+    if "-d" in flags:
+        dis(k)
+    else:
+        z = run(k, Frame(None, None, None, None, {**OPS}))
+        OUT.flush()
+        print(z)